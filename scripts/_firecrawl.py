@@ -0,0 +1,186 @@
+"""Firecrawl HTTP API client shared by the docs scripts.
+
+Used by `extract_shopline_openapi_urls.py` for the reference sidebar and by
+`download_shopline_openapi_docs.py` for page scrapes and batch jobs.
+"""
+
+import http.client
+import json
+import os
+import time
+import urllib.parse
+from collections.abc import Iterator
+
+from _mirror_common import backoff_delay
+
+FIRECRAWL_API_URL = os.environ.get("FIRECRAWL_API_URL", "https://api.firecrawl.dev")
+
+
+class FirecrawlClient:
+    """Small firecrawl HTTP API client.
+
+    Holds a single persistent connection, so TCP+TLS setup is paid once per
+    process rather than per URL. Not thread-safe: the downloader builds one
+    client per worker process (see init_worker) and each worker runs one task
+    at a time, so the connection is a plain attribute rather than thread-local.
+    """
+
+    def __init__(self, api_key: str, api_url: str = FIRECRAWL_API_URL, timeout_s: int = 120) -> None:
+        if not api_key:
+            raise RuntimeError("FIRECRAWL_API_KEY is not set")
+        u = urllib.parse.urlsplit(api_url)
+        self._https = u.scheme == "https"
+        self._host = u.netloc
+        self._base_path = u.path.rstrip("/")
+        self._headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
+        self._timeout_s = timeout_s
+        self._conn_obj: http.client.HTTPConnection | None = None
+
+    def _conn(self) -> http.client.HTTPConnection:
+        if self._conn_obj is None:
+            cls = http.client.HTTPSConnection if self._https else http.client.HTTPConnection
+            self._conn_obj = cls(self._host, timeout=self._timeout_s)
+        return self._conn_obj
+
+    def _drop_conn(self) -> None:
+        if self._conn_obj is not None:
+            self._conn_obj.close()
+        self._conn_obj = None
+
+    def request(self, method: str, path: str, body: dict | None = None) -> dict:
+        if path.startswith("http"):
+            # Pagination links (`next`) are absolute URLs on the same host.
+            u = urllib.parse.urlsplit(path)
+            target = u.path + (f"?{u.query}" if u.query else "")
+        else:
+            target = self._base_path + path
+        payload = json.dumps(body).encode("utf-8") if body is not None else None
+
+        for attempt in range(2):
+            conn = self._conn()
+            try:
+                conn.request(method, target, body=payload, headers=self._headers)
+                resp = conn.getresponse()
+                raw = resp.read()
+                break
+            except ConnectionError:
+                # The server closed an idle keep-alive connection; reconnect once.
+                self._drop_conn()
+                if attempt:
+                    raise
+            except http.client.IncompleteRead as e:
+                # The connection dropped mid-body: a transport error, not bad
+                # JSON, so fail before json.loads and leave it to the caller's backoff.
+                self._drop_conn()
+                raise ConnectionError(
+                    f"firecrawl connection closed mid-response for {method} {path}: "
+                    f"got {len(e.partial)} bytes, {e.expected} more expected"
+                )
+            except Exception:
+                self._drop_conn()
+                raise
+
+        if resp.status >= 400:
+            detail = raw[:200].decode("utf-8", errors="replace")
+            raise RuntimeError(f"firecrawl {method} {path} failed (status={resp.status}): {detail}")
+        try:
+            return json.loads(raw)
+        except json.JSONDecodeError as e:
+            raise RuntimeError(f"firecrawl returned non-JSON for {method} {path}: {e}")
+
+    def scrape(
+        self,
+        url: str,
+        formats: list[str],
+        only_main_content: bool,
+        exclude_tags: list[str] | None,
+        max_age_ms: int,
+    ) -> dict:
+        body: dict = {
+            "url": url,
+            "formats": formats,
+            "onlyMainContent": only_main_content,
+            "maxAge": int(max_age_ms),
+        }
+        if exclude_tags:
+            body["excludeTags"] = exclude_tags
+        resp = self.request("POST", "/v1/scrape", body)
+        data = resp.get("data")
+        if not isinstance(data, dict):
+            raise RuntimeError(f"firecrawl scrape returned no data for {url} (keys={list(resp.keys())})")
+        return data
+
+    def batch_scrape(
+        self,
+        urls: list[str],
+        formats: list[str],
+        only_main_content: bool,
+        exclude_tags: list[str] | None,
+        max_age_ms: int,
+        timeout_s: float,
+        retries: int = 3,
+        backoff_max: float = 30.0,
+        poll_interval_s: float = 2.0,
+    ) -> Iterator[tuple[str, dict]]:
+        """Scrape urls as one batch job, yielding (source URL, document) pairs.
+
+        Results are read one firecrawl page at a time, and each document is
+        dropped once the caller has it. firecrawl decides how many documents go
+        on a page, often the whole batch, so peak memory is one decoded page;
+        --batch-size is what actually bounds it.
+        """
+        body: dict = {
+            "urls": urls,
+            "formats": formats,
+            "onlyMainContent": only_main_content,
+            "maxAge": int(max_age_ms),
+        }
+        if exclude_tags:
+            body["excludeTags"] = exclude_tags
+        job = self.request("POST", "/v1/batch/scrape", body)
+        job_id = job.get("id")
+        if not isinstance(job_id, str):
+            raise RuntimeError(f"firecrawl batch scrape returned no job id (keys={list(job.keys())})")
+
+        deadline = time.monotonic() + timeout_s
+        while True:
+            status = self._get_retrying(f"/v1/batch/scrape/{job_id}", retries, backoff_max)
+            if status.get("status") in ("completed", "failed", "cancelled"):
+                break
+            if time.monotonic() >= deadline:
+                # Stop the job server-side so it doesn't keep spending credits
+                # while the caller falls back to per-URL scrapes.
+                try:
+                    self.request("DELETE", f"/v1/batch/scrape/{job_id}")
+                except Exception:
+                    pass
+                raise RuntimeError(
+                    f"firecrawl batch scrape {job_id} still {status.get('status')!r} after {timeout_s:.0f}s"
+                )
+            time.sleep(poll_interval_s)
+
+        page = status
+        while True:
+            docs = page.pop("data", None) or []
+            while docs:
+                doc = docs.pop()
+                meta = doc.get("metadata") or {}
+                src = meta.get("sourceURL") or meta.get("url")
+                if isinstance(src, str):
+                    yield src, doc
+                del doc
+            next_url = page.get("next")
+            if not isinstance(next_url, str) or not next_url:
+                return
+            page = self._get_retrying(next_url, retries, backoff_max)
+
+    def _get_retrying(self, path: str, retries: int, backoff_max: float) -> dict:
+        # A single 429/reset while polling shouldn't throw away a running job.
+        for attempt in range(retries + 1):
+            try:
+                return self.request("GET", path)
+            except Exception:
+                if attempt == retries:
+                    raise
+                time.sleep(backoff_delay(attempt, backoff_max))
+        raise AssertionError("unreachable")
@@ -0,0 +1,8 @@
+"""Helpers shared by the docs scripts outside manifest bookkeeping (retry backoff)."""
+
+import random
+
+
+def backoff_delay(attempt: int, max_s: float) -> float:
+    # Jittered exponential backoff: ~0.5s, 1s, 2s, ... capped at max_s.
+    return min(max_s, 0.5 * (2**attempt)) + random.random() * 0.2
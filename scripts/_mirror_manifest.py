@@ -0,0 +1,94 @@
+"""Shared bookkeeping for the docs mirror scripts.
+
+Both `download_shopline_openapi_docs.py` and `download_shopline_reference_md.py`
+record each fetched page in `<out>/_manifest.jsonl` and use it to skip fresh
+pages, adopt files already on disk, and schedule work. The helpers live here so
+the two mirrors keep the same on-disk format.
+
+A success record is {"url", "rel", "sha", "bytes", "ts"}, where "rel" is the
+page's .md file as a POSIX path relative to the output directory. A failure
+record is {"url", "error", "ts"}.
+"""
+
+import json
+import os
+from pathlib import Path
+
+MANIFEST_NAME = "_manifest.jsonl"
+
+
+def load_manifest(out_dir: Path) -> tuple[dict[str, dict], set[str]]:
+    """Latest successful record per URL, plus URLs whose latest attempt failed.
+
+    Failure records carry an "error" key; they don't replace an earlier success.
+    Once superseded lines far outnumber live ones, the file is rewritten with
+    just the live records so it doesn't grow without bound across runs.
+    """
+    path = out_dir / MANIFEST_NAME
+    records: dict[str, dict] = {}
+    errors: dict[str, dict] = {}
+    lines = 0
+    try:
+        f = open(path, encoding="utf-8")
+    except FileNotFoundError:
+        return records, set()
+    with f:
+        for line in f:
+            lines += 1
+            try:
+                rec = json.loads(line)
+            except ValueError:
+                # Torn last line from a killed run.
+                continue
+            if not isinstance(rec, dict) or not isinstance(rec.get("url"), str):
+                continue
+            if "error" in rec:
+                errors[rec["url"]] = rec
+            else:
+                records[rec["url"]] = rec
+                errors.pop(rec["url"], None)
+    live = len(records) + len(errors)
+    if lines > 2 * live + 64:
+        # Successes first, so replaying still leaves each failure on top.
+        tmp = path.with_name(path.name + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as out:
+            for rec in (*records.values(), *errors.values()):
+                out.write(json.dumps(rec, ensure_ascii=False, separators=(",", ":")) + "\n")
+        os.replace(tmp, path)
+    return records, set(errors)
+
+
+def existing_files(out_dir: Path, suffix: str = ".md") -> frozenset[str]:
+    """Relative POSIX paths of files under out_dir ending in suffix, from a single walk.
+
+    Taken once per run in place of a stat per URL; nothing else writes to
+    out_dir during a run, so the snapshot stays accurate.
+    """
+    found: set[str] = set()
+    for root, _, files in os.walk(out_dir):
+        rel_root = os.path.relpath(root, out_dir).replace(os.sep, "/")
+        prefix = "" if rel_root == "." else rel_root + "/"
+        found.update(prefix + f for f in files if f.endswith(suffix))
+    return frozenset(found)
+
+
+def schedule(urls: list[str], manifest: dict[str, dict], failed: set[str]) -> list[str]:
+    """Order work largest-first by the size seen last run, known failures last.
+
+    Starting the long pages first (longest-processing-time scheduling) keeps a
+    big page from stalling one worker at the tail while the rest sit idle.
+    Unseen URLs keep their input order.
+    """
+    return sorted(urls, key=lambda u: (u in failed, -int(manifest.get(u, {}).get("bytes", 0))))
+
+
+def append_manifest(out_dir: Path, record: dict) -> None:
+    # One os.write per record on an O_APPEND fd: on a local filesystem each
+    # write lands whole at end-of-file, so lines from concurrent workers never
+    # interleave. (Not guaranteed on NFS.)
+    line = (json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n").encode("utf-8")
+    fd = os.open(out_dir / MANIFEST_NAME, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, line)
+    finally:
+        os.close(fd)
@@ -1,34 +1,51 @@
 #!/usr/bin/env python3
-"""Download Shopline Open API docs pages as markdown using firecrawl CLI.
+"""Download Shopline Open API docs pages as markdown using the firecrawl API.
 
 Inputs:
   - docs/shopline-openapi/urls.txt (one URL per line)
 
 Outputs:
   - docs/shopline-openapi/pages/<path>.md
-  - docs/shopline-openapi/pages/<path>.json (raw firecrawl response)
+  - docs/shopline-openapi/pages/<path>.json.gz (raw firecrawl response; see load_raw)
+  - docs/shopline-openapi/pages/_manifest.jsonl (one record per saved page)
 
-This script is resumable: it skips pages that already have a .md file.
+This script is resumable: it skips pages recorded in the manifest. Non-empty
+.md files on disk without a record (e.g. from an older mirror) are adopted into
+it instead of being scraped again.
+Files are replaced atomically and left untouched when the content is unchanged.
 
 Notes:
   - Default is onlyMainContent=false because Shopline's API reference pages are
     dynamic and often lose the endpoint/method when onlyMainContent=true.
+  - Requires FIRECRAWL_API_KEY (and optionally FIRECRAWL_API_URL). Pages are
+    scraped in batches through the firecrawl batch scrape API
+    (FIRECRAWL_BATCH_SIZE / --batch-size URLs per job); URLs missing from a
+    batch result fall back to a single-page scrape.
 """
 
 import argparse
 import concurrent.futures
+import gzip
+import hashlib
 import json
 import os
 import re
-import subprocess
 import sys
-import threading
+import time
 from pathlib import Path
 
+from _firecrawl import FirecrawlClient
+from _mirror_common import backoff_delay
+from _mirror_manifest import append_manifest, existing_files, load_manifest, schedule
+
+# safe_rel_path runs once per URL; compile its patterns once per process.
+_URL_PATH_RE = re.compile(r"^https?://[^/]+(/.*)$")
+_UNSAFE_CHARS_RE = re.compile(r"[^A-Za-z0-9._\-/]")
+
 
 def safe_rel_path(url: str) -> str:
     # Keep domain path, strip scheme+host.
-    m = re.match(r"^https?://[^/]+(/.*)$", url)
+    m = _URL_PATH_RE.match(url)
     path = m.group(1) if m else url
     path = path.split("#", 1)[0]
     path = path.split("?", 1)[0]
@@ -37,46 +54,160 @@ def safe_rel_path(url: str) -> str:
     if not path:
         return "root"
     # Avoid weird filesystem chars.
-    path = re.sub(r"[^A-Za-z0-9._\-/]", "_", path)
+    path = _UNSAFE_CHARS_RE.sub("_", path)
     return path
 
 
-def run_firecrawl_scrape(url: str, max_age_ms: int) -> dict:
-    return run_firecrawl_scrape_with_options(
-        url=url,
-        max_age_ms=max_age_ms,
-        formats=["markdown"],
-        only_main_content=False,
-    )
+def load_raw(rel: str, out_dir: str | Path = "docs/shopline-openapi/pages") -> dict:
+    """Load the raw firecrawl response stored for rel (as returned by safe_rel_path)."""
+    base = Path(out_dir) / rel
+    gz_path = base.with_name(base.name + ".json.gz")
+    if gz_path.exists():
+        return json.loads(gzip.decompress(gz_path.read_bytes()))
+    # Pages mirrored before raw responses were compressed.
+    return json.loads(base.with_name(base.name + ".json").read_text(encoding="utf-8"))
 
 
-def run_firecrawl_scrape_with_options(
-    url: str,
-    max_age_ms: int,
-    formats: list[str],
-    only_main_content: bool,
-    exclude_tags: list[str] | None,
-) -> dict:
-    cmd = [
-        "firecrawl",
-        "scrape",
-        "--url",
-        url,
-        "--formats",
-        ",".join(formats),
-        "--only-main-content",
-        "true" if only_main_content else "false",
-    ]
-    if exclude_tags:
-        cmd += ["--exclude-tags", ",".join(exclude_tags)]
-    cmd += ["--max-age", str(int(max_age_ms))]
-    p = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-    if p.returncode != 0:
-        raise RuntimeError(f"firecrawl scrape failed (rc={p.returncode}): {p.stderr.strip()}")
+def write_if_changed(path: Path, data: bytes) -> bool:
+    """Atomically replace path with data; skip the write if it already holds data."""
     try:
-        return json.loads(p.stdout)
-    except json.JSONDecodeError as e:
-        raise RuntimeError(f"firecrawl returned non-JSON for {url}: {e}\nstdout prefix: {p.stdout[:200]}")
+        if path.stat().st_size == len(data) and path.read_bytes() == data:
+            return False
+    except FileNotFoundError:
+        pass
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_bytes(data)
+    os.replace(tmp, path)
+    return True
+
+
+def page_paths(out_dir: Path, url: str) -> tuple[Path, Path]:
+    rel = safe_rel_path(url)
+    return out_dir / (rel + ".md"), out_dir / (rel + ".json.gz")
+
+
+def save_page(out_dir: Path, url: str, data: dict) -> None:
+    md_path, raw_path = page_paths(out_dir, url)
+    raw = json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    # mtime=0 keeps the gzip bytes deterministic so unchanged responses skip the write.
+    write_if_changed(raw_path, gzip.compress(raw, compresslevel=6, mtime=0))
+    raw_path.with_name(raw_path.name[: -len(".gz")]).unlink(missing_ok=True)
+    md = data.get("markdown")
+    if not isinstance(md, str):
+        raise RuntimeError(f"missing markdown field (keys={list(data.keys())})")
+    md_bytes = md.encode("utf-8")
+    write_if_changed(md_path, md_bytes)
+    append_manifest(
+        out_dir,
+        {
+            "url": url,
+            "rel": md_path.relative_to(out_dir).as_posix(),
+            "sha": hashlib.blake2b(md_bytes).hexdigest(),
+            "bytes": len(md_bytes),
+            "ts": round(time.time(), 3),
+        },
+    )
+
+
+# Worker processes each build their own client; sockets don't survive pickling/fork.
+_client: FirecrawlClient | None = None
+
+
+def init_worker(api_key: str) -> None:
+    global _client
+    _client = FirecrawlClient(api_key)
+
+
+# Error text produced when firecrawl hands back a bad (cut-off) cached entry.
+# Dropped connections raise ConnectionError instead and never match these.
+_BAD_CACHE_MARKERS = ("non-JSON", "missing markdown")
+
+
+def looks_like_bad_cache(err: Exception) -> bool:
+    return any(m in str(err) for m in _BAD_CACHE_MARKERS)
+
+
+def scrape_one(client: FirecrawlClient, task: dict, url: str) -> str:
+    """Scrape and save one URL with retries; returns the last error ("" on success)."""
+    out_dir = Path(task["out_dir"])
+    attempts = max(1, int(task["retries"]) + 1)
+    last_err: Exception | None = None
+    for attempt in range(attempts):
+        try:
+            data = client.scrape(
+                url=url,
+                formats=task["formats"],
+                only_main_content=task["only_main_content"],
+                exclude_tags=task["exclude_tags"],
+                max_age_ms=task["max_age_ms"],
+            )
+            save_page(out_dir, url, data)
+            return ""
+        except Exception as e:
+            last_err = e
+            # Cached firecrawl entries can be truncated/invalid JSON. If that is
+            # what failed, retry once with maxAge=0 to force a fresh scrape; other
+            # errors go through the normal retry loop instead.
+            if attempt == 0 and int(task["max_age_ms"]) > 0 and looks_like_bad_cache(e):
+                try:
+                    data = client.scrape(
+                        url=url,
+                        formats=task["formats"],
+                        only_main_content=task["only_main_content"],
+                        exclude_tags=task["exclude_tags"],
+                        max_age_ms=0,
+                    )
+                    save_page(out_dir, url, data)
+                    return ""
+                except Exception as e2:
+                    last_err = e2
+        if attempt < attempts - 1:
+            time.sleep(backoff_delay(attempt, task["backoff_max"]))
+    return str(last_err)
+
+
+def process_urls(task: dict) -> list[tuple[str, str]]:
+    """Worker entry point: scrape and save task["urls"].
+
+    task is a plain dict so it pickles cheaply across the process boundary.
+    Returns (url, error) pairs, with error "" for pages that were saved.
+    """
+    client = _client
+    assert client is not None, "init_worker was not run"
+    out_dir = Path(task["out_dir"])
+
+    statuses = []
+    saved: set[str] = set()
+    if task["batch"]:
+        wanted = set(task["urls"])
+        try:
+            for url, data in client.batch_scrape(
+                urls=task["urls"],
+                formats=task["formats"],
+                only_main_content=task["only_main_content"],
+                exclude_tags=task["exclude_tags"],
+                max_age_ms=task["max_age_ms"],
+                timeout_s=task["batch_timeout"],
+                retries=task["retries"],
+                backoff_max=task["backoff_max"],
+            ):
+                if url not in wanted or url in saved:
+                    continue
+                try:
+                    save_page(out_dir, url, data)
+                except Exception:
+                    # Left for the per-URL scrape below.
+                    continue
+                saved.add(url)
+                statuses.append((url, ""))
+        except Exception as e:
+            n = len(task["urls"]) - len(saved)
+            print(f"[WARN] batch scrape failed, falling back to per-URL scrape for {n} urls: {e}", file=sys.stderr)
+
+    for url in task["urls"]:
+        if url not in saved:
+            statuses.append((url, scrape_one(client, task, url)))
+    return statuses
 
 
 def main() -> int:
@@ -103,13 +234,35 @@ def main() -> int:
         "--jobs",
         type=int,
         default=1,
-        help="number of parallel firecrawl processes (default: 1; higher can cause truncated/non-JSON output on large pages)",
+        help="number of worker processes, each running one firecrawl request/batch job at a time (default: 1)",
+    )
+    ap.add_argument(
+        "--batch-size",
+        type=int,
+        default=int(os.environ.get("FIRECRAWL_BATCH_SIZE", "10")),
+        help="URLs per firecrawl batch scrape job (default: $FIRECRAWL_BATCH_SIZE or 10; <=1 scrapes one URL per request)",
+    )
+    ap.add_argument(
+        "--batch-timeout",
+        type=float,
+        default=600.0,
+        help="seconds to wait for a batch job before cancelling it and scraping its URLs one by one (default: 600)",
     )
     ap.add_argument("--retries", type=int, default=2, help="retry per-URL on transient firecrawl failures")
+    ap.add_argument(
+        "--backoff-max",
+        type=float,
+        default=30.0,
+        help="cap in seconds for the jittered exponential backoff between retries (default: 30)",
+    )
     ap.add_argument("--limit", type=int, default=0, help="0 = no limit")
-    ap.add_argument("--force", action="store_true", help="re-download even if md exists")
+    ap.add_argument("--force", action="store_true", help="re-download even if the page is already in the manifest")
     args = ap.parse_args()
 
+    api_key = os.environ.get("FIRECRAWL_API_KEY", "")
+    if not api_key:
+        raise SystemExit("FIRECRAWL_API_KEY is not set")
+
     urls_path = Path(args.urls)
     out_dir = Path(args.out)
     out_dir.mkdir(parents=True, exist_ok=True)
@@ -124,78 +277,75 @@ def main() -> int:
     skipped = 0
     failed = 0
 
-    lock = threading.Lock()
-
-    def one(url: str) -> None:
-        nonlocal total, skipped, failed
-
-        rel = safe_rel_path(url)
-        md_path = out_dir / (rel + ".md")
-        raw_path = out_dir / (rel + ".json")
-        md_path.parent.mkdir(parents=True, exist_ok=True)
-
-        if md_path.exists() and not args.force:
-            with lock:
-                skipped += 1
-            return
-
-        formats = [x.strip() for x in str(args.formats).split(",") if x.strip()]
-        exclude = [x.strip() for x in str(args.exclude_tags).split(",") if x.strip()]
-        if not args.only_main_content and not exclude:
-            # The reference pages are massive, and including scripts can push some
-            # scrapes over firecrawl's output limits (leading to invalid JSON).
-            exclude = ["script", "style"]
-
-        last_err: Exception | None = None
-        for attempt in range(max(1, int(args.retries) + 1)):
-            try:
-                data = run_firecrawl_scrape_with_options(
-                    url=url,
-                    max_age_ms=args.max_age_ms,
-                    formats=formats,
-                    only_main_content=bool(args.only_main_content),
-                    exclude_tags=exclude,
-                )
-                raw_path.write_text(json.dumps(data, indent=2, ensure_ascii=False), encoding="utf-8")
-                md = data.get("markdown")
-                if not isinstance(md, str):
-                    raise RuntimeError(f"missing markdown field (keys={list(data.keys())})")
-                md_path.write_text(md, encoding="utf-8")
-                with lock:
-                    total += 1
-                return
-            except Exception as e:
-                last_err = e
-                # Cached firecrawl entries can be truncated/invalid JSON. If we were
-                # using cache, retry once with maxAge=0 to force a fresh scrape.
-                if attempt == 0 and int(args.max_age_ms) > 0:
-                    try:
-                        data = run_firecrawl_scrape_with_options(
-                            url=url,
-                            max_age_ms=0,
-                            formats=formats,
-                            only_main_content=bool(args.only_main_content),
-                            exclude_tags=exclude,
-                        )
-                        raw_path.write_text(json.dumps(data, indent=2, ensure_ascii=False), encoding="utf-8")
-                        md = data.get("markdown")
-                        if not isinstance(md, str):
-                            raise RuntimeError(f"missing markdown field (keys={list(data.keys())})")
-                        md_path.write_text(md, encoding="utf-8")
-                        with lock:
-                            total += 1
-                        return
-                    except Exception as e2:
-                        last_err = e2
-        with lock:
-            failed += 1
-        print(f"[FAIL] {url}: {last_err}", file=sys.stderr)
+    exclude = [x.strip() for x in str(args.exclude_tags).split(",") if x.strip()]
+    if not args.only_main_content and not exclude:
+        # The reference pages are massive, and including scripts can push some
+        # scrapes over firecrawl's output limits (leading to invalid JSON).
+        exclude = ["script", "style"]
 
     # Apply --limit to the processing queue (downloaded+failed), not the input list size.
     queue = urls if not args.limit else urls[: args.limit]
+    manifest, failed_before = load_manifest(out_dir)
+    existing = existing_files(out_dir)
+    # Adopt pages already on disk that have no record (mirrors older than the
+    # manifest). Keyed per URL, so a --limit run can't leave the rest unadopted.
+    for url in queue:
+        if url in manifest or safe_rel_path(url) + ".md" not in existing:
+            continue
+        md_path, _ = page_paths(out_dir, url)
+        if md_path.stat().st_size > 0:
+            md_bytes = md_path.read_bytes()
+            rec = {
+                "url": url,
+                "rel": md_path.relative_to(out_dir).as_posix(),
+                "sha": hashlib.blake2b(md_bytes).hexdigest(),
+                "bytes": len(md_bytes),
+                "ts": round(md_path.stat().st_mtime, 3),
+            }
+            append_manifest(out_dir, rec)
+            manifest[url] = rec
+
+    pending = []
+    for url in queue:
+        # A recorded page whose md file has since been deleted is fetched again.
+        if url in manifest and safe_rel_path(url) + ".md" in existing and not args.force:
+            skipped += 1
+        else:
+            pending.append(url)
+    pending = schedule(pending, manifest, failed_before)
+
+    # Create each output directory once up front instead of once per URL.
+    for parent in {page_paths(out_dir, url)[0].parent for url in pending}:
+        parent.mkdir(parents=True, exist_ok=True)
+
+    batch_size = max(1, int(args.batch_size))
+    base_task = {
+        "out_dir": str(out_dir),
+        "formats": [x.strip() for x in str(args.formats).split(",") if x.strip()],
+        "only_main_content": bool(args.only_main_content),
+        "exclude_tags": exclude,
+        "max_age_ms": int(args.max_age_ms),
+        "retries": int(args.retries),
+        "backoff_max": float(args.backoff_max),
+        "batch": batch_size > 1,
+        "batch_timeout": float(args.batch_timeout),
+    }
+    tasks = [{**base_task, "urls": pending[i : i + batch_size]} for i in range(0, len(pending), batch_size)]
+
+    # Processes rather than threads: JSON decode + gzip of multi-MB pages is CPU
+    # work that would otherwise serialize on the GIL.
     jobs = max(1, int(args.jobs))
-    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as ex:
-        list(ex.map(one, queue))
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=jobs, initializer=init_worker, initargs=(api_key,)
+    ) as ex:
+        for statuses in ex.map(process_urls, tasks):
+            for url, err in statuses:
+                if err:
+                    failed += 1
+                    print(f"[FAIL] {url}: {err}", file=sys.stderr)
+                    append_manifest(out_dir, {"url": url, "error": err[:500], "ts": round(time.time(), 3)})
+                else:
+                    total += 1
 
     print(json.dumps({"downloaded": total, "skipped": skipped, "failed": failed, "total_urls": len(urls)}))
     return 0 if failed == 0 else 2
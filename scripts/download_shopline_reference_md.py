@@ -15,26 +15,43 @@ Inputs:
 Outputs (local-only; intentionally not committed):
   - docs/shopline-openapi/pages_md/<path>.md
     Example: docs/shopline-openapi/pages_md/reference/get_orders-1.md
+  - docs/shopline-openapi/pages_md/<path>.md.meta.json (ETag/Last-Modified)
+  - docs/shopline-openapi/pages_md/_manifest.jsonl (one record per fetched page)
+
+Re-runs skip pages whose manifest record is younger than --max-age-ms and
+revalidate older ones with a conditional GET (If-None-Match /
+If-Modified-Since), so unchanged pages cost a 304 instead of a full download.
 """
 
 from __future__ import annotations
 
 import argparse
+import asyncio
 import concurrent.futures
+import hashlib
+import http.client
 import json
-import random
+import os
 import re
 import sys
 import threading
 import time
-import urllib.error
-import urllib.request
+import urllib.parse
 from pathlib import Path
 
+from _mirror_common import backoff_delay
+from _mirror_manifest import append_manifest, existing_files, load_manifest, schedule
+
+REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+
+# safe_rel_path runs once per URL; compile its patterns once per process.
+_URL_PATH_RE = re.compile(r"^https?://[^/]+(/.*)$")
+_UNSAFE_CHARS_RE = re.compile(r"[^A-Za-z0-9._/-]")
+
 
 def safe_rel_path(url: str) -> str:
     # Keep domain path, strip scheme+host.
-    m = re.match(r"^https?://[^/]+(/.*)$", url)
+    m = _URL_PATH_RE.match(url)
     path = m.group(1) if m else url
     path = path.split("#", 1)[0]
     path = path.split("?", 1)[0]
@@ -42,7 +59,7 @@ def safe_rel_path(url: str) -> str:
     if not path:
         return "root"
     # Keep "/" to preserve directory structure.
-    return re.sub(r"[^A-Za-z0-9._/-]", "_", path)
+    return _UNSAFE_CHARS_RE.sub("_", path)
 
 
 def to_md_url(u: str) -> str:
@@ -54,103 +71,393 @@ def to_md_url(u: str) -> str:
     return u + ".md"
 
 
-def fetch_text(url: str, timeout_s: int) -> tuple[int, str]:
-    req = urllib.request.Request(
-        url,
-        headers={
-            "User-Agent": "shopline-cli-docs-mirror/1.0",
-            "Accept": "text/plain, text/markdown;q=0.9, */*;q=0.1",
-        },
-        method="GET",
-    )
+def md_path_for(out_dir: Path, md_url: str) -> Path:
+    rel = safe_rel_path(md_url)
+    md_path = out_dir / rel
+    if md_path.suffix != ".md":
+        md_path = out_dir / (rel + ".md")
+    return md_path
+
+
+def meta_path_for(md_path: Path) -> Path:
+    return md_path.with_name(md_path.name + ".meta.json")
+
+
+def load_meta(meta_path: Path) -> dict:
     try:
-        with urllib.request.urlopen(req, timeout=timeout_s) as resp:
-            status = int(getattr(resp, "status", 200))
-            data = resp.read()
-            text = data.decode("utf-8", errors="replace")
-            return status, text
-    except urllib.error.HTTPError as e:
-        body = ""
+        data = json.loads(meta_path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+def conditional_headers(meta: dict) -> dict[str, str]:
+    headers = {}
+    if meta.get("etag"):
+        headers["If-None-Match"] = meta["etag"]
+    if meta.get("last_modified"):
+        headers["If-Modified-Since"] = meta["last_modified"]
+    return headers
+
+
+def if_range_validator(headers: dict[str, str]) -> str:
+    # If-Range only accepts a strong ETag; fall back to Last-Modified.
+    etag = headers.get("etag", "")
+    if etag and not etag.startswith("W/"):
+        return etag
+    return headers.get("last-modified", "")
+
+
+class ConnectionPool:
+    """Keep-alive HTTP(S) connections shared by the fetch threads.
+
+    A connection is checked out for one request and handed back once its
+    response body has been fully read, so consecutive URLs on the same host
+    reuse the TCP+TLS session instead of handshaking each time.
+    """
+
+    def __init__(self, maxsize: int, timeout_s: int) -> None:
+        self._maxsize = maxsize
+        self._timeout_s = timeout_s
+        self._idle: dict[tuple[str, str, int], list[http.client.HTTPConnection]] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(conn: http.client.HTTPConnection) -> tuple[str, str, int]:
+        scheme = "https" if isinstance(conn, http.client.HTTPSConnection) else "http"
+        return scheme, conn.host, conn.port
+
+    def _checkout(self, key: tuple[str, str, int], fresh: bool) -> tuple[http.client.HTTPConnection, bool]:
+        if not fresh:
+            with self._lock:
+                idle = self._idle.get(key)
+                if idle:
+                    return idle.pop(), True
+        scheme, host, port = key
+        cls = http.client.HTTPSConnection if scheme == "https" else http.client.HTTPConnection
+        return cls(host, port, timeout=self._timeout_s), False
+
+    def request(
+        self, method: str, url: str, headers: dict[str, str]
+    ) -> tuple[http.client.HTTPConnection, http.client.HTTPResponse]:
+        u = urllib.parse.urlsplit(url)
+        key = (u.scheme, u.hostname or "", u.port or (443 if u.scheme == "https" else 80))
+        target = (u.path or "/") + (f"?{u.query}" if u.query else "")
+        fresh = False
+        while True:
+            conn, reused = self._checkout(key, fresh)
+            try:
+                conn.request(method, target, headers=headers)
+                return conn, conn.getresponse()
+            except ConnectionError:
+                conn.close()
+                # An idle keep-alive connection may have been closed by the server.
+                if not reused:
+                    raise
+                fresh = True
+            except BaseException:
+                conn.close()
+                raise
+
+    def release(self, conn: http.client.HTTPConnection, resp: http.client.HTTPResponse) -> None:
+        if resp.will_close or not resp.isclosed():
+            conn.close()
+            return
+        with self._lock:
+            idle = self._idle.setdefault(self._key(conn), [])
+            if len(idle) < self._maxsize:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def close(self) -> None:
+        with self._lock:
+            conns = [c for idle in self._idle.values() for c in idle]
+            self._idle.clear()
+        for conn in conns:
+            conn.close()
+
+
+def download_to(
+    pool: ConnectionPool, part_path: Path, url: str, headers: dict[str, str] | None = None
+) -> tuple[int, dict[str, str]]:
+    """Stream url into part_path, resuming from its current size via Range.
+
+    Returns (status, response headers). Status 0 means the transfer was
+    interrupted (connect error, timeout, short body) or the partial had to be
+    discarded; whatever arrived is kept in part_path so the next attempt only
+    requests the remaining bytes.
+    """
+    offset = part_path.stat().st_size if part_path.exists() else 0
+    req_headers = {
+        "User-Agent": "shopline-cli-docs-mirror/1.0",
+        "Accept": "text/plain, text/markdown;q=0.9, */*;q=0.1",
+        **(headers or {}),
+    }
+    if offset:
+        req_headers["Range"] = f"bytes={offset}-"
+
+    for _ in range(5):
         try:
-            body = e.read().decode("utf-8", errors="replace")
-        except Exception:
-            body = ""
-        return int(getattr(e, "code", 0) or 0), body
+            conn, resp = pool.request("GET", url, req_headers)
+        except (OSError, http.client.HTTPException):
+            return 0, {}
+        status = int(resp.status)
+        resp_headers = {k.lower(): v for k, v in resp.headers.items()}
+        location = resp_headers.get("location")
+        if status not in REDIRECT_STATUSES or not location:
+            break
+        try:
+            resp.read()
+        except (OSError, http.client.HTTPException):
+            conn.close()
+        else:
+            pool.release(conn, resp)
+        url = urllib.parse.urljoin(url, location)
 
+    if status not in (200, 206):
+        if status == 416 and offset:
+            # The partial no longer lines up with the resource; start over.
+            part_path.unlink(missing_ok=True)
+            status = 0
+        try:
+            resp.read()
+        except (OSError, http.client.HTTPException):
+            conn.close()
+        else:
+            pool.release(conn, resp)
+        return status, resp_headers
 
-def main() -> int:
-    ap = argparse.ArgumentParser()
-    ap.add_argument("--urls", default="docs/shopline-openapi/urls_endpoints.txt")
-    ap.add_argument("--out", default="docs/shopline-openapi/pages_md")
-    ap.add_argument("--jobs", type=int, default=6)
-    ap.add_argument("--timeout", type=int, default=30)
-    ap.add_argument("--retries", type=int, default=3)
-    ap.add_argument("--force", action="store_true", help="re-download even if the md file exists")
-    ap.add_argument("--limit", type=int, default=0, help="0 = no limit")
-    args = ap.parse_args()
+    if status == 206:
+        if not offset or not resp_headers.get("content-range", "").startswith(f"bytes {offset}-"):
+            # A range we did not ask for; drop the partial and retry from scratch.
+            conn.close()
+            part_path.unlink(missing_ok=True)
+            return 0, resp_headers
+        mode = "ab"
+    else:
+        # Server ignored the Range (or If-Range saw a new version): restart from byte 0.
+        mode = "wb"
+    expected = resp_headers.get("content-length")
+    written = 0
+    try:
+        with open(part_path, mode) as f:
+            while chunk := resp.read(65536):
+                f.write(chunk)
+                written += len(chunk)
+    except (OSError, http.client.HTTPException):
+        conn.close()
+        return 0, resp_headers
+    if expected is not None and written < int(expected):
+        conn.close()
+        return 0, resp_headers
+    pool.release(conn, resp)
+    return status, resp_headers
 
-    urls_path = Path(args.urls)
-    out_dir = Path(args.out)
-    out_dir.mkdir(parents=True, exist_ok=True)
 
-    urls = [
-        line.strip()
-        for line in urls_path.read_text(encoding="utf-8").splitlines()
-        if line.strip() and not line.strip().startswith("#")
-    ]
-    if args.limit and args.limit > 0:
-        urls = urls[: args.limit]
+def file_digest(path: Path) -> str:
+    h = hashlib.blake2b()
+    with open(path, "rb") as f:
+        while chunk := f.read(65536):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def save(md_path: Path, part_path: Path, url: str, headers: dict[str, str]) -> tuple[str, int]:
+    meta_path = meta_path_for(md_path)
+    digest = file_digest(part_path)
+    if md_path.exists() and load_meta(meta_path).get("blake2b") == digest:
+        # Same bytes as the mirrored copy: leave the md file (and its mtime) alone.
+        part_path.unlink()
+    else:
+        os.replace(part_path, md_path)
+    meta = {
+        "url": url,
+        "etag": headers.get("etag", ""),
+        "last_modified": headers.get("last-modified", ""),
+        "blake2b": digest,
+    }
+    tmp = meta_path.with_name(meta_path.name + ".tmp")
+    tmp.write_text(json.dumps(meta, ensure_ascii=False) + "\n", encoding="utf-8")
+    os.replace(tmp, meta_path)
+    return digest, md_path.stat().st_size
+
+
+async def run(urls: list[str], out_dir: Path, args: argparse.Namespace) -> dict[str, int]:
+    http_concurrency = max(1, int(args.http_concurrency))
+    loop = asyncio.get_running_loop()
+    # Fetches are blocking http.client calls run on worker threads; give every
+    # semaphore slot its own thread and pooled connection.
+    loop.set_default_executor(concurrent.futures.ThreadPoolExecutor(max_workers=http_concurrency))
+    sem = asyncio.Semaphore(http_concurrency)
+    pool = ConnectionPool(maxsize=http_concurrency, timeout_s=int(args.timeout))
+    # Finalizing a page (hash, rename, sidecar) runs on its own, smaller pool so
+    # disk work never holds up an HTTP slot.
+    write_ex = concurrent.futures.ThreadPoolExecutor(max_workers=max(1, int(args.write_concurrency)))
+
+    manifest, failed_before = load_manifest(out_dir)
+    existing = existing_files(out_dir)
+    # Adopt pages already on disk that have no record (mirrors older than the
+    # manifest), aged by their sidecar (or md file) mtime. Keyed per URL, so a
+    # --limit run can't leave the rest unadopted.
+    for url in urls:
+        if url in manifest:
+            continue
+        md_path = md_path_for(out_dir, to_md_url(url))
+        if md_path.relative_to(out_dir).as_posix() not in existing or md_path.stat().st_size == 0:
+            continue
+        meta_path = meta_path_for(md_path)
+        stamp = meta_path if meta_path.exists() else md_path
+        rec = {
+            "url": url,
+            "rel": md_path.relative_to(out_dir).as_posix(),
+            "sha": load_meta(meta_path).get("blake2b") or file_digest(md_path),
+            "bytes": md_path.stat().st_size,
+            "ts": round(stamp.stat().st_mtime, 3),
+        }
+        append_manifest(out_dir, rec)
+        manifest[url] = rec
 
     downloaded = 0
     skipped = 0
     failed = 0
-    lock = threading.Lock()
 
-    def one(url: str) -> None:
+    async def one(url: str) -> None:
         nonlocal downloaded, skipped, failed
 
         md_url = to_md_url(url)
-        rel = safe_rel_path(md_url)
-        md_path = out_dir / rel
-        if md_path.suffix != ".md":
-            md_path = out_dir / (rel + ".md")
-        md_path.parent.mkdir(parents=True, exist_ok=True)
-
-        if md_path.exists() and not args.force:
-            with lock:
+        md_path = md_path_for(out_dir, md_url)
+
+        meta_path = meta_path_for(md_path)
+        req_headers: dict[str, str] = {}
+        rec = manifest.get(url)
+        if rec and rec.get("rel") not in existing:
+            # Recorded, but the md file has since been deleted: fetch it again.
+            rec = None
+        if rec and not args.force:
+            # Age comes from the manifest (refreshed on every 304), so no stat is needed.
+            if (time.time() - float(rec.get("ts", 0))) * 1000 < int(args.max_age_ms):
                 skipped += 1
-            return
+                return
+            req_headers = conditional_headers(load_meta(meta_path))
+
+        # Partials are only resumed within a run, where If-Range can vouch for them.
+        part_path = md_path.with_name(md_path.name + ".part")
+        part_path.unlink(missing_ok=True)
+        validator = ""
 
         last = None
         for attempt in range(int(args.retries) + 1):
-            status, text = fetch_text(md_url, timeout_s=int(args.timeout))
-            if status == 200 and text:
-                md_path.write_text(text, encoding="utf-8")
-                with lock:
-                    downloaded += 1
+            attempt_headers = dict(req_headers)
+            if part_path.exists():
+                if validator:
+                    attempt_headers["If-Range"] = validator
+                else:
+                    # Without If-Range a changed page would be spliced onto stale bytes.
+                    part_path.unlink()
+            async with sem:
+                status, headers = await asyncio.to_thread(download_to, pool, part_path, md_url, attempt_headers)
+            if headers:
+                validator = if_range_validator(headers)
+            if status == 304 and rec and req_headers:
+                part_path.unlink(missing_ok=True)
+                append_manifest(out_dir, {**rec, "ts": round(time.time(), 3)})
+                skipped += 1
+                return
+            if status in (200, 206) and part_path.stat().st_size > 0:
+                digest, size = await loop.run_in_executor(write_ex, save, md_path, part_path, md_url, headers)
+                append_manifest(
+                    out_dir,
+                    {
+                        "url": url,
+                        "rel": md_path.relative_to(out_dir).as_posix(),
+                        "sha": digest,
+                        "bytes": size,
+                        "ts": round(time.time(), 3),
+                    },
+                )
+                downloaded += 1
                 return
 
-            # Back off on throttling / transient errors.
-            if status in (429, 500, 502, 503, 504):
-                # Jittered exponential backoff: ~0.5s, 1s, 2s, ...
-                delay = (0.5 * (2**attempt)) + random.random() * 0.2
-                time.sleep(delay)
+            # Back off on interruptions, throttling and transient errors.
+            if status in (0, 429, 500, 502, 503, 504):
+                # Sleeping outside the semaphore frees the slot for other URLs.
+                await asyncio.sleep(backoff_delay(attempt, args.backoff_max))
                 last = f"status={status}"
                 continue
 
             last = f"status={status}"
             break
 
-        with lock:
-            failed += 1
+        part_path.unlink(missing_ok=True)
+        failed += 1
         print(f"[FAIL] {md_url}: {last}", file=sys.stderr)
+        append_manifest(out_dir, {"url": url, "error": str(last), "ts": round(time.time(), 3)})
+
+    # Create each output directory once up front instead of once per URL.
+    for parent in {md_path_for(out_dir, to_md_url(url)).parent for url in urls}:
+        parent.mkdir(parents=True, exist_ok=True)
+
+    try:
+        await asyncio.gather(*(one(url) for url in schedule(urls, manifest, failed_before)))
+    finally:
+        pool.close()
+        write_ex.shutdown()
+    return {"downloaded": downloaded, "skipped": skipped, "failed": failed}
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--urls", default="docs/shopline-openapi/urls_endpoints.txt")
+    ap.add_argument("--out", default="docs/shopline-openapi/pages_md")
+    ap.add_argument(
+        "--http-concurrency",
+        "--jobs",
+        dest="http_concurrency",
+        type=int,
+        default=32,
+        help="max in-flight HTTP requests / pooled connections (default: 32; --jobs is an alias)",
+    )
+    ap.add_argument(
+        "--write-concurrency",
+        type=int,
+        default=os.cpu_count() or 4,
+        help="threads finalizing downloaded pages on disk (default: CPU count)",
+    )
+    ap.add_argument("--timeout", type=int, default=30)
+    ap.add_argument("--retries", type=int, default=3)
+    ap.add_argument(
+        "--backoff-max",
+        type=float,
+        default=30.0,
+        help="cap in seconds for the jittered exponential backoff between retries (default: 30)",
+    )
+    ap.add_argument("--force", action="store_true", help="re-download even if the page is already in the manifest")
+    ap.add_argument(
+        "--max-age-ms",
+        type=int,
+        default=7 * 24 * 3600 * 1000,
+        help="skip existing pages younger than this; older ones are revalidated with a conditional GET (default: 7d)",
+    )
+    ap.add_argument("--limit", type=int, default=0, help="0 = no limit")
+    args = ap.parse_args()
+
+    urls_path = Path(args.urls)
+    out_dir = Path(args.out)
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    urls = [
+        line.strip()
+        for line in urls_path.read_text(encoding="utf-8").splitlines()
+        if line.strip() and not line.strip().startswith("#")
+    ]
+    if args.limit and args.limit > 0:
+        urls = urls[: args.limit]
 
-    jobs = max(1, int(args.jobs))
-    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as ex:
-        list(ex.map(one, urls))
+    counts = asyncio.run(run(urls, out_dir, args))
 
-    print(json.dumps({"downloaded": downloaded, "skipped": skipped, "failed": failed, "total_urls": len(urls)}))
-    return 0 if failed == 0 else 2
+    print(json.dumps({**counts, "total_urls": len(urls)}))
+    return 0 if counts["failed"] == 0 else 2
 
 
 if __name__ == "__main__":
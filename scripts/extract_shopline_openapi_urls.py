@@ -1,10 +1,13 @@
 #!/usr/bin/env python3
 """Extract Shopline Open API docs URLs from the reference sidebar.
 
-This script uses `firecrawl scrape` to fetch the reference HTML, then extracts
-all `/reference/...` and `/docs...` links.
+This script uses the firecrawl scrape API (FIRECRAWL_API_KEY, optionally
+FIRECRAWL_API_URL) to fetch the reference HTML, then extracts all
+`/reference/...` and `/docs...` links.
 
 Outputs:
+  - docs/shopline-openapi/_discovery/reference.html (+ reference.meta.json);
+    reused while younger than --max-age-ms
   - docs/shopline-openapi/urls.txt
   - docs/shopline-openapi/urls_endpoints.txt
   - docs/shopline-openapi/urls_non_endpoints.txt
@@ -13,35 +16,63 @@ Note: The bulk downloaded corpus is handled by `scripts/download_shopline_openap
 """
 
 import argparse
+import http.client
 import json
+import os
 import re
-import subprocess
+import time
+from html.parser import HTMLParser
 from pathlib import Path
-from urllib.parse import urlparse
 
+from _firecrawl import FirecrawlClient
 
-def firecrawl_scrape_html(url: str, max_age_ms: int) -> str:
-    raw = {"url": url, "formats": ["html"], "onlyMainContent": False, "maxAge": max_age_ms}
-    cmd = [
-        "firecrawl",
-        "scrape",
-        "--url",
-        url,
-        "--formats",
-        "html",
-        "--only-main-content",
-        "false",
-        "--raw",
-        json.dumps(raw),
-    ]
-    p = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-    if p.returncode != 0:
-        raise SystemExit(f"firecrawl scrape failed (rc={p.returncode}): {p.stderr.strip()}")
-    data = json.loads(p.stdout)
+DOCS_ORIGIN = "https://open-api.docs.shoplineapp.com"
+_KEEP_PREFIXES = (DOCS_ORIGIN + "/reference", DOCS_ORIGIN + "/docs")
+_KEEP_EXACT = frozenset({DOCS_ORIGIN + "/changelog", DOCS_ORIGIN + "/discuss"})
+_ENDPOINT_RE = re.compile(r"^https://open-api\.docs\.shoplineapp\.com/reference/(get|post|put|patch|delete|del)_[A-Za-z0-9]")
+
+
+class HrefCollector(HTMLParser):
+    """Collect `<a href>` values in one pass, whatever their quoting style."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.hrefs: set[str] = set()
+
+    def handle_starttag(self, tag: str, attrs: list[tuple[str, str | None]]) -> None:
+        if tag != "a":
+            return
+        for name, value in attrs:
+            if name == "href" and value:
+                self.hrefs.add(value)
+
+
+def extract_hrefs(html: str) -> set[str]:
+    parser = HrefCollector()
+    parser.feed(html)
+    parser.close()
+    return parser.hrefs
+
+
+def firecrawl_scrape_html(client: FirecrawlClient, url: str, max_age_ms: int) -> tuple[str, dict]:
+    """Scrape url as HTML; returns (html, firecrawl metadata)."""
+    try:
+        data = client.scrape(
+            url, formats=["html"], only_main_content=False, exclude_tags=None, max_age_ms=max_age_ms
+        )
+    except (RuntimeError, OSError, http.client.HTTPException) as e:
+        raise SystemExit(f"firecrawl scrape failed: {e}")
     html = data.get("html")
     if not isinstance(html, str):
         raise SystemExit(f"unexpected firecrawl response keys={list(data.keys())}")
-    return html
+    return html, data.get("metadata") or {}
+
+
+def write_atomic(path: Path, text: str) -> None:
+    """Replace path via a sibling tmp file so an interrupted run never leaves it truncated."""
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_text(text, encoding="utf-8")
+    os.replace(tmp, path)
 
 
 def main() -> int:
@@ -52,7 +83,12 @@ def main() -> int:
         help="Reference page URL. (Prefer the reference index; some endpoint pages can be too large to scrape as HTML.)",
     )
     ap.add_argument("--out-dir", default="docs/shopline-openapi")
-    ap.add_argument("--max-age-ms", type=int, default=172800000)
+    ap.add_argument(
+        "--max-age-ms",
+        type=int,
+        default=172800000,
+        help="firecrawl cache maxAge, and how long the local reference.html stays fresh (default: 48h)",
+    )
     args = ap.parse_args()
 
     out_dir = Path(args.out_dir)
@@ -62,75 +98,43 @@ def main() -> int:
     # (and to avoid occasional truncation on very large pages).
     discovery_dir = out_dir / "_discovery"
     discovery_dir.mkdir(parents=True, exist_ok=True)
-    cached = discovery_dir / "reference.html.json"
+    cached = discovery_dir / "reference.html"
+    cached_meta = discovery_dir / "reference.meta.json"
 
     html = ""
-    if cached.exists():
-        try:
-            data = json.loads(cached.read_text(encoding="utf-8"))
-            if isinstance(data, dict) and isinstance(data.get("html"), str):
-                html = data["html"]
-        except Exception:
-            html = ""
+    if cached.exists() and (time.time() - cached.stat().st_mtime) * 1000 < args.max_age_ms:
+        html = cached.read_text(encoding="utf-8")
 
     if not html:
-        raw = {"url": args.url, "formats": ["html"], "onlyMainContent": False, "maxAge": args.max_age_ms}
-        cmd = [
-            "firecrawl",
-            "scrape",
-            "--url",
-            args.url,
-            "--formats",
-            "html",
-            "--only-main-content",
-            "false",
-            "--raw",
-            json.dumps(raw),
-        ]
-        p = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-        if p.returncode != 0:
-            raise SystemExit(f"firecrawl scrape failed (rc={p.returncode}): {p.stderr.strip()}")
-        cached.write_text(p.stdout, encoding="utf-8")
-        data = json.loads(p.stdout)
-        html = data.get("html", "")
-
-    hrefs = set(re.findall(r'href="([^"]+)"', html))
+        api_key = os.environ.get("FIRECRAWL_API_KEY", "")
+        if not api_key:
+            raise SystemExit("FIRECRAWL_API_KEY is not set")
+        # The full reference page is slow to render; allow longer than a page scrape.
+        client = FirecrawlClient(api_key, timeout_s=300)
+        html, metadata = firecrawl_scrape_html(client, args.url, args.max_age_ms)
+        # Meta first: the html's mtime decides freshness, so it must land last.
+        meta = {"url": args.url, "metadata": metadata}
+        write_atomic(cached_meta, json.dumps(meta, indent=2, ensure_ascii=False) + "\n")
+        write_atomic(cached, html)
+
+    hrefs = extract_hrefs(html)
 
     urls = set()
     for h in hrefs:
-        if h.startswith("https://open-api.docs.shoplineapp.com/"):
+        if h.startswith(DOCS_ORIGIN + "/"):
             urls.add(h.split("#", 1)[0])
         elif h.startswith("/"):
-            urls.add("https://open-api.docs.shoplineapp.com" + h.split("#", 1)[0])
-
-    keep = []
-    for u in urls:
-        if urlparse(u).netloc != "open-api.docs.shoplineapp.com":
-            continue
-        if u.startswith("https://open-api.docs.shoplineapp.com/reference") or u.startswith(
-            "https://open-api.docs.shoplineapp.com/docs"
-        ):
-            keep.append(u)
-        elif u in {
-            "https://open-api.docs.shoplineapp.com/changelog",
-            "https://open-api.docs.shoplineapp.com/discuss",
-        }:
-            keep.append(u)
-
-    keep = sorted(set(keep))
+            urls.add(DOCS_ORIGIN + h.split("#", 1)[0])
+
+    keep = sorted(u for u in urls if u.startswith(_KEEP_PREFIXES) or u in _KEEP_EXACT)
 
     endpoints = []
+    non_endpoints = []
     for u in keep:
-        if not u.startswith("https://open-api.docs.shoplineapp.com/reference/"):
-            continue
-        slug = u.split("/reference/", 1)[1]
-        if re.match(r"^(get|post|put|patch|delete|del)_[A-Za-z0-9].*", slug):
-            endpoints.append(u)
-
-    non_endpoints = sorted(set(keep) - set(endpoints))
+        (endpoints if _ENDPOINT_RE.match(u) else non_endpoints).append(u)
 
     (out_dir / "urls.txt").write_text("\n".join(keep) + "\n", encoding="utf-8")
-    (out_dir / "urls_endpoints.txt").write_text("\n".join(sorted(endpoints)) + "\n", encoding="utf-8")
+    (out_dir / "urls_endpoints.txt").write_text("\n".join(endpoints) + "\n", encoding="utf-8")
     (out_dir / "urls_non_endpoints.txt").write_text("\n".join(non_endpoints) + "\n", encoding="utf-8")
 
     print(json.dumps({"all": len(keep), "endpoints": len(endpoints), "non_endpoints": len(non_endpoints)}))